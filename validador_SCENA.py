@@ -4,122 +4,180 @@ from datetime import datetime
 import numpy as np
 import io
 
-def load_data(uploaded_file):
-    try:
-        df = pd.read_csv(uploaded_file, 
-                        sep=';', 
-                        encoding='utf-8')
-        return df, None
-    except Exception as e:
-        return None, f"Erro ao carregar arquivo: {str(e)}"
-
-def convert_datetime(date_str, time_str):
-    if pd.isna(date_str) or pd.isna(time_str):
-        return None
-    try:
-        date_obj = datetime.strptime(date_str, '%d/%m/%Y')
-        time_obj = datetime.strptime(time_str, '%H:%M').time()
-        return datetime.combine(date_obj.date(), time_obj)
-    except Exception as e:
-        print(f"Erro na conversão: {date_str} {time_str} - {str(e)}")
-        return None
+CATEGORY_COLUMNS = ['Sit.', 'Est.', 'Cl.', 'Assoc. Sit.', 'Assoc. Est.', 'Org.']
+REGISTRATION_PREFIXES = ('PT', 'PS', 'PP', 'PR', 'PU')
+EXCECOES_ORIGEM = frozenset({'MVD', 'EZE', 'LIS', 'AEP', 'SID', 'MCO', 'FLL', 'TFS', 'RKA', 'LPA', 'ACC', 'MIA', 'RAK'})
+
+VIOLATION_CATEGORY = pd.CategoricalDtype([
+    'status_violations',
+    'time_violations',
+    'station_violations',
+    'registration_violations',
+    'movement_violations',
+    'operation_violations',
+    'assoc_time_violations',
+    'registration_match_violations',
+    'fab_service_violations',
+    'service_match_violations'
+])
+VIOLATION_COLUMNS = ['categoria', 'voo', 'mensagem']
+VIOLATION_LABELS = {
+    'fab_service_violations': "Violações de Serviço FAB:",
+    'registration_match_violations': "Violações de Correspondência de Registro:",
+    'time_violations': "Violações de Data/Hora (Fecha+ALDT < F.ETime+AIBT):",
+    'status_violations': "Violações de Status (Sit.):",
+    'station_violations': "Violações de Estação (Est.):",
+    'registration_violations': "Violações de Registro/Classe:",
+    'movement_violations': "Violações de Estação Associada (Assoc. Est.):",
+    'operation_violations': "Violações de Status Associado (Assoc. Sit.):",
+    'assoc_time_violations': "Violações de Data/Hora (Assoc. Data+AOBT < Assoc. F.ETime+ATOT):",
+    'service_match_violations': "Violações de Tipos de Serviço da Chegada e Partida):"
+}
+
+# Uploads larger than this are parsed and validated CHUNK_SIZE rows at a time
+CHUNKED_READ_BYTES = 50 * 1024 * 1024
+CHUNK_SIZE = 100_000
+CSV_OPTIONS = {'sep': ';', 'encoding': 'utf-8', 'dtype': str}
+
+def read_csv(file_bytes, chunksize=None):
+    # The C engine keeps every cell as the exported text; the pyarrow engine infers types first and
+    # only then casts to str, rewriting values such as 10:00 -> 10:00:00 or 007 -> 7.
+    # The line right after the header in Scena exports is not a flight record.
+    return pd.read_csv(io.BytesIO(file_bytes), engine='c', low_memory=False, skiprows=[1],
+                       chunksize=chunksize, **CSV_OPTIONS)
+
+def prepare_frame(df):
+    category_columns = [column for column in CATEGORY_COLUMNS if column in df.columns]
+    df[category_columns] = df[category_columns].astype('category')
+    return df
+
+def load_data(file_bytes):
+    if len(file_bytes) <= CHUNKED_READ_BYTES:
+        yield prepare_frame(read_csv(file_bytes))
+    else:
+        for chunk in read_csv(file_bytes, chunksize=CHUNK_SIZE):
+            yield prepare_frame(chunk)
+
+def matches_any(series, values, missing=False):
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        matches = series.isin(values)
+        return (matches | series.isna()).to_numpy() if missing else matches.to_numpy()
+    # Test each category once and index the result by code; missing values (code -1) hit the trailing entry
+    matches = series.cat.categories.isin(values)
+    return np.append(matches, missing)[series.cat.codes.to_numpy()]
+
+def parse_unique(series, date_format):
+    # Dates and times repeat across thousands of flights, so each distinct string is parsed only once
+    codes, uniques = pd.factorize(series)
+    parsed = pd.to_datetime(uniques, format=date_format, exact=True, errors='coerce').to_numpy()
+    # Missing values (code -1) hit the trailing NaT
+    return np.append(parsed, np.datetime64('NaT'))[codes]
+
+def combine_datetime(dates, times):
+    time_of_day = parse_unique(times, '%H:%M') - np.datetime64('1900-01-01')
+    return parse_unique(dates, '%d/%m/%Y') + time_of_day
+
+def offending_rows(df, mask, columns):
+    # One ndarray per column, zipped into tuples, avoids building a 2-D object array from mixed dtypes
+    offending = df.loc[mask, ['Id.Vuelo', *columns]]
+    return zip(*(offending[column].to_numpy() for column in offending.columns))
 
 def validate_flights(df):
-    violations = {
-        'status_violations': [],
-        'time_violations': [],
-        'station_violations': [],
-        'registration_violations': [],
-        'movement_violations': [],
-        'operation_violations': [],
-        'assoc_time_violations': [],
-        'registration_match_violations': [],
-        'fab_service_violations': [],
-        'service_match_violations': []  # New violation type
-    }
-    
-    df = df[~df['Sit.'].isin(['CAN', 'BOR'])]
-    
-    for idx, row in df.iloc[1:].iterrows():
-        flight_id = row['Id.Vuelo']
-        
-        # New validation for service match
-        if pd.notna(row['Sv.']) and pd.notna(row['Assoc. Sv.']):
-            if row['Sv.'] != row['Assoc. Sv.']:
-                violations['service_match_violations'].append(
-                    f"Voo {flight_id}: Serviço ({row['Sv.']}) " +
-                    f"não corresponde ao serviço associado ({row['Assoc. Sv.']})")
-        
-        # Rest of the existing validations
-        if pd.notna(row['Registro']) and 'FAB' in row['Registro']:
-            if row['Sv.'] != 'W':
-                violations['fab_service_violations'].append(
-                    f"Voo {flight_id}: Registro FAB ({row['Registro']}) deve ter Serv. = W, encontrado: {row['Sv.']}")
-        
-        arrival_datetime = convert_datetime(row['Fecha'], row['ALDT'])
-        block_datetime = convert_datetime(row['F.ETime'], row['AIBT'])
-        
-        if pd.notna(row['Registro']) and pd.notna(row['Assoc. Registro']):
-            if row['Registro'] != row['Assoc. Registro']:
-                violations['registration_match_violations'].append(
-                    f"Voo {flight_id}: Registro de chegada ({row['Registro']}) " +
-                    f"não corresponde ao registro de saída ({row['Assoc. Registro']})")
-        
-        if arrival_datetime and block_datetime:
-            if not arrival_datetime <= block_datetime:
-                violations['time_violations'].append(
-                    f"Voo {flight_id}: Fecha+ALDT ({row['Fecha']} {row['ALDT']}) " +
-                    f"não é anterior ou igual a F.ETime+AIBT ({row['F.ETime']} {row['AIBT']})")
-        
-        if row['Sit.'] != 'OPE':
-            violations['status_violations'].append(
-                f"Voo {flight_id}: Status inválido: {row['Sit.']}")
-        
-        if row['Est.'] != 'IBK':
-            violations['station_violations'].append(
-                f"Voo {flight_id}: Estação inválida: {row['Est.']}")
-        
-        if pd.notna(row['Registro']):
-            prefix = row['Registro'][:2]
-            origem = row['Org.']
-            excecoes_origem = ['MVD', 'EZE', 'LIS', 'AEP','SID','MCO','FLL','TFS','RKA','LPA','ACC','MIA','LPA','RAK']
-            
-            if prefix in ['PT', 'PS', 'PP', 'PR', 'PU']:
-                if origem not in excecoes_origem and row['Cl.'] != 'A':
-                    violations['registration_violations'].append(
-                        f"Voo {flight_id}: Registro {row['Registro']} (Origem: {origem}) deve ter classe A, encontrado: {row['Cl.']}")
-        
-        if pd.notna(row['Assoc. Sit.']) and row['Assoc. Sit.'] not in ['OPE', '']:
-            violations['operation_violations'].append(
-                f"Voo {flight_id}: Status associado inválido: {row['Assoc. Sit.']}")
-        
-        if pd.notna(row['Assoc. Est.']) and row['Assoc. Est.'] not in ['AIR', '']:
-            violations['movement_violations'].append(
-                f"Voo {flight_id}: Estação associada inválida: {row['Assoc. Est.']}")
-        
-        if pd.notna(row['Assoc. AOBT']) and pd.notna(row['Assoc. ATOT']):
-            aobt_datetime = convert_datetime(row['Assoc. Data'], row['Assoc. AOBT'])
-            atot_datetime = convert_datetime(row['Assoc. F.ETime'], row['Assoc. ATOT'])
-            
-            if aobt_datetime and atot_datetime:
-                if not aobt_datetime <= atot_datetime:
-                    violations['assoc_time_violations'].append(
-                        f"Voo {flight_id}: Assoc. Data+AOBT ({row['Assoc. Data']} {row['Assoc. AOBT']}) " +
-                        f"não é anterior ou igual a Assoc. F.ETime+ATOT ({row['Assoc. F.ETime']} {row['Assoc. ATOT']})")
+    violations = []
+    
+    df = df[~matches_any(df['Sit.'], ['CAN', 'BOR'])]
+    
+    # New validation for service match
+    mask = df['Sv.'].notna() & df['Assoc. Sv.'].notna() & df['Sv.'].ne(df['Assoc. Sv.'])
+    violations.extend(
+        ('service_match_violations', flight_id, f"Voo {flight_id}: Serviço ({sv}) não corresponde ao serviço associado ({assoc_sv})")
+        for flight_id, sv, assoc_sv in offending_rows(df, mask, ['Sv.', 'Assoc. Sv.']))
+    
+    # Rest of the existing validations
+    mask = df['Registro'].str.contains('FAB', regex=False, na=False) & df['Sv.'].ne('W')
+    violations.extend(
+        ('fab_service_violations', flight_id, f"Voo {flight_id}: Registro FAB ({registro}) deve ter Serv. = W, encontrado: {sv}")
+        for flight_id, registro, sv in offending_rows(df, mask, ['Registro', 'Sv.']))
+    
+    mask = (df['Registro'].notna() & df['Assoc. Registro'].notna()
+            & df['Registro'].ne(df['Assoc. Registro']))
+    violations.extend(
+        ('registration_match_violations', flight_id, f"Voo {flight_id}: Registro de chegada ({registro}) não corresponde ao registro de saída ({assoc_registro})")
+        for flight_id, registro, assoc_registro in offending_rows(df, mask, ['Registro', 'Assoc. Registro']))
+    
+    arrival_datetime = combine_datetime(df['Fecha'], df['ALDT'])
+    block_datetime = combine_datetime(df['F.ETime'], df['AIBT'])
+    # NaT compares as False in NumPy, so unparseable dates/times never flag a violation
+    mask = arrival_datetime > block_datetime
+    violations.extend(
+        ('time_violations', flight_id, f"Voo {flight_id}: Fecha+ALDT ({fecha} {aldt}) não é anterior ou igual a F.ETime+AIBT ({fetime} {aibt})")
+        for flight_id, fecha, aldt, fetime, aibt in offending_rows(df, mask, ['Fecha', 'ALDT', 'F.ETime', 'AIBT']))
+    
+    mask = ~matches_any(df['Sit.'], ['OPE'])
+    violations.extend(
+        ('status_violations', flight_id, f"Voo {flight_id}: Status inválido: {sit}")
+        for flight_id, sit in offending_rows(df, mask, ['Sit.']))
+    
+    mask = ~matches_any(df['Est.'], ['IBK'])
+    violations.extend(
+        ('station_violations', flight_id, f"Voo {flight_id}: Estação inválida: {est}")
+        for flight_id, est in offending_rows(df, mask, ['Est.']))
+    
+    mask = (df['Registro'].str.startswith(REGISTRATION_PREFIXES, na=False)
+            & ~matches_any(df['Org.'], EXCECOES_ORIGEM) & ~matches_any(df['Cl.'], ['A']))
+    violations.extend(
+        ('registration_violations', flight_id, f"Voo {flight_id}: Registro {registro} (Origem: {origem}) deve ter classe A, encontrado: {cl}")
+        for flight_id, registro, origem, cl in offending_rows(df, mask, ['Registro', 'Org.', 'Cl.']))
+    
+    mask = ~matches_any(df['Assoc. Sit.'], ['OPE', ''], missing=True)
+    violations.extend(
+        ('operation_violations', flight_id, f"Voo {flight_id}: Status associado inválido: {assoc_sit}")
+        for flight_id, assoc_sit in offending_rows(df, mask, ['Assoc. Sit.']))
+    
+    mask = ~matches_any(df['Assoc. Est.'], ['AIR', ''], missing=True)
+    violations.extend(
+        ('movement_violations', flight_id, f"Voo {flight_id}: Estação associada inválida: {assoc_est}")
+        for flight_id, assoc_est in offending_rows(df, mask, ['Assoc. Est.']))
     
-    return df, violations
+    aobt_datetime = combine_datetime(df['Assoc. Data'], df['Assoc. AOBT'])
+    atot_datetime = combine_datetime(df['Assoc. F.ETime'], df['Assoc. ATOT'])
+    mask = aobt_datetime > atot_datetime
+    violations.extend(
+        ('assoc_time_violations', flight_id, f"Voo {flight_id}: Assoc. Data+AOBT ({assoc_data} {aobt}) não é anterior ou igual a Assoc. F.ETime+ATOT ({assoc_fetime} {atot})")
+        for flight_id, assoc_data, aobt, assoc_fetime, atot in offending_rows(
+            df, mask, ['Assoc. Data', 'Assoc. AOBT', 'Assoc. F.ETime', 'Assoc. ATOT']))
+    
+    return df, pd.DataFrame(violations, columns=VIOLATION_COLUMNS).astype({'categoria': VIOLATION_CATEGORY})
+
+# Each entry holds a full validated CSV plus its violations, so keep only the last few uploads
+@st.cache_data(show_spinner=False, max_entries=4, ttl='1h')
+def validate_file(file_bytes):
+    preview = None
+    violations = []
+    total_records = 0
+    validated_records = 0
+    output = io.BytesIO()
+    for chunk in load_data(file_bytes):
+        chunk_validated, chunk_violations = validate_flights(chunk)
+        violations.append(chunk_violations)
+        chunk_validated.to_csv(output, header=preview is None, index=False, sep=';', encoding='utf-8')
+        if preview is None:
+            preview = chunk_validated
+        total_records += len(chunk)
+        validated_records += len(chunk_validated)
+    violations = pd.concat(violations, ignore_index=True)
+    return preview, violations, total_records, validated_records, output.getvalue()
 
 def generate_validation_report(violations, total_records):
     report = []
     report.append("Relatório de Validação\n")
     report.append(f"Total de registros processados: {total_records}\n")
-    report.append(f"Total de violações encontradas: {sum(len(v) for v in violations.values())}\n\n")
+    report.append(f"Total de violações encontradas: {len(violations)}\n\n")
     
-    for violation_type, violation_list in violations.items():
-        if violation_list:
-            report.append(f"\n{violation_type.replace('_', ' ').title()}:\n")
-            for violation in violation_list:
-                report.append(f"- {violation}\n")
+    for violation_type, group in violations.groupby('categoria', observed=True):
+        report.append(f"\n{violation_type.replace('_', ' ').title()}:\n")
+        for violation in group['mensagem']:
+            report.append(f"- {violation}\n")
     
     return "".join(report)
 
@@ -142,70 +200,38 @@ def main():
     uploaded_file = st.file_uploader("Escolha um arquivo CSV", type='csv')
     
     if uploaded_file is not None:
-        df, error = load_data(uploaded_file)
-        
-        if error:
-            st.error(error)
+        # Errors are raised rather than returned so a failed run is never cached for this upload
+        try:
+            result = validate_file(uploaded_file.getvalue())
+        except Exception as e:
+            st.error(f"Erro ao carregar arquivo: {str(e)}")
             return
         
-        df_validated, violations = validate_flights(df)
+        df_validated, violations, total_records, validated_records, csv = result
         
         st.subheader('Resumo das Validações')
-        total_violations = sum(len(v) for v in violations.values())
-        st.write(f"Total de registros processados: {len(df)-1}")
+        total_violations = len(violations)
+        st.write(f"Total de registros processados: {total_records}")
         st.write(f"Total de violações encontradas: {total_violations}")
         
         if total_violations > 0:
             st.subheader('Violações por Categoria')
+            counts = violations['categoria'].value_counts()
             
-            if violations['fab_service_violations']:
-                st.write("Violações de Serviço FAB:", len(violations['fab_service_violations']))
-                st.write(violations['fab_service_violations'])
-            
-            if violations['registration_match_violations']:
-                st.write("Violações de Correspondência de Registro:", len(violations['registration_match_violations']))
-                st.write(violations['registration_match_violations'])
-            
-            if violations['time_violations']:
-                st.write("Violações de Data/Hora (Fecha+ALDT < F.ETime+AIBT):", len(violations['time_violations']))
-                st.write(violations['time_violations'])
-            
-            if violations['status_violations']:
-                st.write("Violações de Status (Sit.):", len(violations['status_violations']))
-                st.write(violations['status_violations'])
-            
-            if violations['station_violations']:
-                st.write("Violações de Estação (Est.):", len(violations['station_violations']))
-                st.write(violations['station_violations'])
-            
-            if violations['registration_violations']:
-                st.write("Violações de Registro/Classe:", len(violations['registration_violations']))
-                st.write(violations['registration_violations'])
-            
-            if violations['movement_violations']:
-                st.write("Violações de Estação Associada (Assoc. Est.):", len(violations['movement_violations']))
-                st.write(violations['movement_violations'])
-            
-            if violations['operation_violations']:
-                st.write("Violações de Status Associado (Assoc. Sit.):", len(violations['operation_violations']))
-                st.write(violations['operation_violations'])
-            
-            if violations['assoc_time_violations']:
-                st.write("Violações de Data/Hora (Assoc. Data+AOBT < Assoc. F.ETime+ATOT):", 
-                        len(violations['assoc_time_violations']))
-                st.write(violations['assoc_time_violations'])
-
-            if violations['service_match_violations']:
-                st.write("Violações de Tipos de Serviço da Chegada e Partida):", 
-                        len(violations['service_match_violations']))
-                st.write(violations['service_match_violations'])
+            for violation_type, label in VIOLATION_LABELS.items():
+                if counts[violation_type]:
+                    st.write(label, counts[violation_type])
+                    st.dataframe(violations.loc[violations['categoria'] == violation_type, ['voo', 'mensagem']],
+                                 hide_index=True)
         
         st.subheader('Dados Validados')
+        if validated_records > len(df_validated):
+            st.caption(f"Exibindo os primeiros {len(df_validated)} de {validated_records} registros; "
+                       "o CSV para download contém todos.")
         st.dataframe(df_validated)
         
         col1, col2 = st.columns(2)
         with col1:
-            csv = df_validated.to_csv(index=False, sep=';', encoding='utf-8')
             st.download_button(
                 label="Baixar dados validados (CSV)",
                 data=csv,
@@ -214,7 +240,7 @@ def main():
             )
         
         with col2:
-            validation_report = generate_validation_report(violations, len(df)-1)
+            validation_report = generate_validation_report(violations, total_records)
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             st.download_button(
                 label="Baixar relatório de validação (TXT)",